@@ -1,16 +1,55 @@
 import sqlite3
 import logging
+import sys
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Tuple
+from itertools import chain, compress, repeat
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
 
 ALERT_WIND_THRESHOLD = 58.0
 ALERT_TEMP_LOW_THRESHOLD = -19.0
 ALERT_WEATHER_CODES_PRECIP = {51, 53, 55, 61, 63, 65, 80, 81, 82, 95}
 
+# bitmaska kodów opadów: test przynależności to jedno przesunięcie + AND
+_CODES_MASK = 0
+for _c in ALERT_WEATHER_CODES_PRECIP:
+    _CODES_MASK |= 1 << _c
+del _c
+
+# stałe prefiksy komunikatów per blok payloadu - progi formatujemy raz, przy imporcie.
+# Alerty z minutely_15 mają własny prefiks: przedział z tym samym startem w obu
+# blokach to dwa osobne alerty (i osobne wiersze), a nie jeden nadpisywany drugim
+_MSG_PREFIXES = {
+    "hourly": {
+        "temperature": f"Temperatura poniżej {ALERT_TEMP_LOW_THRESHOLD} °C od ",
+        "wind_speed": f"Wiatr powyżej {ALERT_WIND_THRESHOLD} m/s od ",
+        "precipitation": "Opady od ",
+    },
+    "minutely_15": {
+        "temperature": f"Temperatura poniżej {ALERT_TEMP_LOW_THRESHOLD} °C (15 min) od ",
+        "wind_speed": f"Wiatr powyżej {ALERT_WIND_THRESHOLD} m/s (15 min) od ",
+        "precipitation": "Opady (15 min) od ",
+    },
+}
+# długość kroku bloku w minutach - czas trwania przedziału w komunikacie
+_BLOCK_STEP_MIN = {"hourly": 60, "minutely_15": 15}
+
+
+def _msg_prefix(metric: str, message: str) -> str | None:
+    """Prefiks komunikatu alertu tego modułu (wyznacza też blok); None dla obcych komunikatów."""
+    for prefixes in _MSG_PREFIXES.values():
+        prefix = prefixes.get(metric)
+        if prefix is not None and message.startswith(prefix):
+            return prefix
+    return None
+
 LOGGER = logging.getLogger("meteofetch")
 
 
 def _extract_hour(ts: str) -> str:
+    # stały format YYYY-MM-DDTHH:MM - wycinek bez alokowania listy
+    if len(ts) >= 16 and ts[10] == "T":
+        return ts[11:16]
     try:
         if "T" not in ts:
             return "?"
@@ -19,132 +58,311 @@ def _extract_hour(ts: str) -> str:
         return "?"
 
 
-def insert_alert_db(conn: sqlite3.Connection, location_id: int, timestamp: str | None,
-                    metric: str, value: float, message: str) -> int:
+ALERT_INSERT_SQL = (
+    "INSERT OR IGNORE INTO alerts (location_id, timestamp, metric, value, message, origin) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+# trwający przedział alertu ma przy każdym odpytaniu inny komunikat ("... przez Nh") -
+# nadpisujemy wtedy istniejący wiersz tego modułu z tego samego bloku (rozpoznany po
+# prefiksie komunikatu, który zawiera metrykę i blok)
+ALERT_UPDATE_SQL = (
+    "UPDATE alerts SET value=?, message=?, origin=? "
+    "WHERE location_id=? AND timestamp=? AND metric=? AND substr(message, 1, ?)=?"
+)
+# wstawienie tylko wtedy, gdy UPDATE nie znalazł wiersza tego przedziału
+ALERT_INSERT_NEW_SQL = (
+    "INSERT INTO alerts (location_id, timestamp, metric, value, message, origin) "
+    "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM alerts "
+    "WHERE location_id=? AND timestamp=? AND metric=? AND substr(message, 1, ?)=?)"
+)
+
+if sys.version_info >= (3, 11):
+    # od 3.11 fromisoformat rozumie sufiks "Z" - bez kopiowania stringa
+    _parse_iso = datetime.fromisoformat
+else:
+    def _parse_iso(ts: str) -> datetime:
+        if ts.endswith("Z"):
+            return datetime.fromisoformat(ts[:-1] + "+00:00")
+        return datetime.fromisoformat(ts)
+
+
+def _parse_ts(ts: str) -> datetime | None:
     try:
-        origin = "detected"
-        try:
-            if timestamp:
-                t_dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-                origin = "predicted" if t_dt > datetime.utcnow() else "historical"
-        except Exception:
-            pass
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT OR IGNORE INTO alerts (location_id, timestamp, metric, value, message, origin) VALUES (?, ?, ?, ?, ?, ?)",
-            (location_id, timestamp, metric, value, message, origin)
-        )
-        conn.commit()
-        if cur.rowcount:
-            LOGGER.warning("ALERT: %s (loc=%d) %s=%.2f", message, location_id, metric, value)
-            return 1
+        return _parse_iso(ts)
+    except Exception:
+        return None
+
+
+def _build_alert_row(location_id: int, timestamp: str | None, t_dt: datetime | None, metric: str,
+                     value: float, message: str, now: datetime) -> Tuple:
+    """Zbuduj krotkę alertu gotową do `executemany` (bez dotykania bazy).
+
+    `t_dt` to już sparsowany `timestamp` - nie parsujemy go drugi raz.
+    """
+    origin = "detected"
+    if t_dt is not None:
+        origin = "predicted" if t_dt > now else "historical"
+    return (location_id, timestamp, metric, value, message, origin)
+
+
+# Ostatnio zapisane alerty: (plik bazy, lokalizacja, timestamp, metryka, prefiks) ->
+# (wartość, komunikat, origin). Przy odpytywaniu w pętli ten sam payload daje te
+# same alerty - pomijamy je zanim trafią do SQL. Rozmiar ograniczony jak w LRU.
+_SEEN_ALERTS_MAX = 50_000
+_seen_alerts: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+# alerty zapisane w otwartej transakcji wywołującego (połączenie -> klucz -> wartości);
+# do `_seen_alerts` trafiają dopiero po jej COMMIT - po ROLLBACK wierszy nie ma w bazie
+_alerts_pending: Dict[sqlite3.Connection, Dict[Tuple, Tuple]] = {}
+
+
+def _remember_alerts(items: Iterable[Tuple[Tuple, Tuple]]) -> None:
+    for key, seen in items:
+        _seen_alerts[key] = seen
+        _seen_alerts.move_to_end(key)
+    while len(_seen_alerts) > _SEEN_ALERTS_MAX:
+        _seen_alerts.popitem(last=False)
+
+
+def publish_pending_alerts(conn: sqlite3.Connection) -> None:
+    """Wywołać po COMMIT transakcji, w której `insert_alerts_db` dołączył do zapisu."""
+    pending = _alerts_pending.pop(conn, None)
+    if pending:
+        _remember_alerts(pending.items())
+
+
+def drop_pending_alerts(conn: sqlite3.Connection) -> None:
+    """Wywołać po ROLLBACK takiej transakcji - jej alerty zostaną zapisane ponownie."""
+    _alerts_pending.pop(conn, None)
+
+
+def _write_alerts(conn: sqlite3.Connection, rows: List[Tuple]) -> int:
+    """Zaktualizuj istniejące alerty (ta sama lokalizacja, start, metryka i blok), resztę wstaw.
+
+    Najpierw jeden `executemany` z UPDATE, potem jeden z INSERT tylko dla przedziałów,
+    których UPDATE nie znalazł (w partii każdy przedział występuje raz).
+    """
+    keyed = []
+    plain = []
+    for row in rows:
+        prefix = _msg_prefix(row[2], row[4])
+        if prefix is not None and row[1] is not None:
+            keyed.append((row, prefix))
+        else:
+            plain.append(row)
+    written = 0
+    if keyed:
+        written += conn.executemany(ALERT_UPDATE_SQL, [
+            (value, message, origin, location_id, timestamp, metric, len(prefix), prefix)
+            for (location_id, timestamp, metric, value, message, origin), prefix in keyed
+        ]).rowcount
+        written += conn.executemany(ALERT_INSERT_NEW_SQL, [
+            (*row, row[0], row[1], row[2], len(prefix), prefix) for row, prefix in keyed
+        ]).rowcount
+    if plain:
+        written += conn.executemany(ALERT_INSERT_SQL, plain).rowcount
+    return written
+
+
+def insert_alerts_db(conn: sqlite3.Connection, rows: List[Tuple]) -> int:
+    """Zapisz wiele alertów w jednej transakcji. Zwraca liczbę wstawionych lub zaktualizowanych wierszy.
+
+    Alert to przedział (lokalizacja, start, metryka, blok); jeśli już istnieje, a zmienił się
+    komunikat lub wartość (przedział trwa dłużej), wiersz jest aktualizowany zamiast
+    dopisywany. Alerty bez zmian od ostatniego zapisu w tym procesie są pomijane.
+
+    Przy otwartej transakcji wywołującego zapis do niej dołącza; wywołujący po
+    COMMIT woła `publish_pending_alerts`, a po ROLLBACK `drop_pending_alerts`.
+    """
+    if not rows:
         return 0
+    if not conn.in_transaction:
+        # transakcja, do której dołączyło poprzednie wywołanie, już się skończyła,
+        # a wywołujący nie zgłosił wyniku - nie wiadomo, czy wiersze są w bazie
+        _alerts_pending.pop(conn, None)
+    pending = _alerts_pending.get(conn, {})
+    db_row = conn.execute("PRAGMA database_list").fetchone()
+    db_file = db_row[2] if db_row else ""
+    # ostatni wiersz dla klucza wygrywa - w partii jeden zapis na przedział
+    batch: Dict[Tuple, Tuple] = {}
+    for row in rows:
+        key = (db_file, row[0], row[1], row[2], _msg_prefix(row[2], row[4]))
+        seen = (row[3], row[4], row[5])
+        if _seen_alerts.get(key) == seen or pending.get(key) == seen:
+            batch.pop(key, None)
+            continue
+        batch[key] = row
+    if not batch:
+        return 0
+    fresh = list(batch.values())
+    joined = conn.in_transaction
+    try:
+        if joined:
+            # wywołujący trzyma otwartą transakcję i sam zrobi commit
+            written = _write_alerts(conn, fresh)
+        else:
+            # jawna transakcja - także dla połączenia w trybie autocommit
+            # (isolation_level=None), gdzie `with conn:` żadnej nie otwiera
+            conn.execute("BEGIN")
+            try:
+                written = _write_alerts(conn, fresh)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
     except Exception:
-        LOGGER.exception("Nie udało się zapisać alertu do DB")
+        LOGGER.exception("Nie udało się zapisać alertów do DB")
         return 0
+    stored = ((key, (row[3], row[4], row[5])) for key, row in batch.items())
+    if joined:
+        _alerts_pending.setdefault(conn, {}).update(stored)
+    else:
+        _remember_alerts(stored)
+    if LOGGER.isEnabledFor(logging.WARNING):
+        for location_id, _, metric, value, message, _ in fresh:
+            LOGGER.warning("ALERT: %s (loc=%d) %s=%.2f", message, location_id, metric, value)
+    return written
 
 
 # --- NOWE FUNKCJE AGREGUJĄCE ---
 
-def _aggregate_series(times: List[str], values: List[Any], check_fn) -> List[Tuple[str, int, float]]:
+def _select(values: List[Any], mask: List[bool]) -> Iterator[Any]:
+    """Wybierz elementy serii wskazane maską; krótsza seria jest dopełniana None."""
+    return compress(chain(values, repeat(None)), mask)
+
+
+def _as_floats(values: Iterable[Any]) -> List[float | None]:
+    """Zamień serię na listę float/None jednym przebiegiem."""
+    return [float(v) if v is not None else None for v in values]
+
+
+def _fused_aggregate(times: List[str], temps: List[float | None], winds: List[float | None],
+                     precips: List[float | None]) -> Tuple[List[Tuple[str, int, float]], ...]:
     """
-    Grupuje kolejne punkty czasowe w przedziały.
-    Zwraca listę (start_ts, duration_hours, value).
+    Jednym przebiegiem po osi czasu grupuje kolejne punkty w przedziały dla
+    niskiej temperatury, silnego wiatru i opadów (`precips`: wartość lub None).
+    Zwraca trzy listy (start_ts, liczba punktów, value).
     """
-    results = []
-    current = None
-    for i, ts in enumerate(times):
-        val = values[i] if i < len(values) else None
-        if check_fn(val):
-            if current is None:
-                current = {"start": ts, "count": 1, "val": float(val) if val is not None else 0.0}
+    temp_runs: List[Tuple[str, int, float]] = []
+    wind_runs: List[Tuple[str, int, float]] = []
+    precip_runs: List[Tuple[str, int, float]] = []
+    t_start = w_start = p_start = None
+    t_count = w_count = p_count = 0
+    t_val = w_val = p_val = 0.0
+    # progi jako zmienne lokalne - w pętli LOAD_FAST zamiast LOAD_GLOBAL
+    temp_th = ALERT_TEMP_LOW_THRESHOLD
+    wind_th = ALERT_WIND_THRESHOLD
+    for ts, temp, wind, precip in zip(times, temps, winds, precips):
+        if temp is not None and temp <= temp_th:
+            if t_start is None:
+                t_start, t_count, t_val = ts, 1, temp
             else:
-                current["count"] += 1
-        else:
-            if current:
-                results.append((current["start"], current["count"], current["val"]))
-                current = None
-    if current:
-        results.append((current["start"], current["count"], current["val"]))
-    return results
+                t_count += 1
+        elif t_start is not None:
+            temp_runs.append((t_start, t_count, t_val))
+            t_start = None
 
+        if wind is not None and wind > wind_th:
+            if w_start is None:
+                w_start, w_count, w_val = ts, 1, wind
+            else:
+                w_count += 1
+        elif w_start is not None:
+            wind_runs.append((w_start, w_count, w_val))
+            w_start = None
 
-def analyze_payload_and_alert(conn: sqlite3.Connection, location_id: int, payload: Dict[str, Any]) -> int:
-    added = 0
-    try:
-        now = datetime.utcnow()
-        max_dt = now + timedelta(days=2)
+        if precip is not None:
+            if p_start is None:
+                p_start, p_count, p_val = ts, 1, precip
+            else:
+                p_count += 1
+        elif p_start is not None:
+            precip_runs.append((p_start, p_count, p_val))
+            p_start = None
 
-        def is_in_range(ts: str) -> bool:
-            try:
-                t_dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
-                return now <= t_dt <= max_dt
-            except Exception:
-                return False
-
-        def process_block(block: Dict[str, Any]):
-            nonlocal added
-            times = block.get("time", [])
-            if not times:
-                return
-            temps = block.get("temperature_2m", [])
-            winds = block.get("wind_speed_10m", [])
-            rains = block.get("rain", [])
-            snows = block.get("snowfall", [])
-            codes = block.get("weather_code") or block.get("weathercode") or []
-
-            # filtrujemy tylko czasy w zakresie
-            valid_idx = [i for i, ts in enumerate(times) if is_in_range(ts)]
-            times = [times[i] for i in valid_idx]
-            temps = [temps[i] if i < len(temps) else None for i in valid_idx]
-            winds = [winds[i] if i < len(winds) else None for i in valid_idx]
-            rains = [rains[i] if i < len(rains) else None for i in valid_idx]
-            snows = [snows[i] if i < len(snows) else None for i in valid_idx]
-            codes = [codes[i] if i < len(codes) else None for i in valid_idx]
-
-            # --- agregacja temperatury ---
-            temp_series = _aggregate_series(times, temps, lambda v: v is not None and float(v) <= ALERT_TEMP_LOW_THRESHOLD)
-            for start, hours, val in temp_series:
-                hour_str = _extract_hour(start)
-                added += insert_alert_db(conn, location_id, start, "temperature", val,
-                                         f"Temperatura poniżej {ALERT_TEMP_LOW_THRESHOLD} °C od {hour_str} przez {hours}h")
-
-            # --- agregacja wiatru ---
-            wind_series = _aggregate_series(times, winds, lambda v: v is not None and float(v) > ALERT_WIND_THRESHOLD)
-            for start, hours, val in wind_series:
-                hour_str = _extract_hour(start)
-                added += insert_alert_db(conn, location_id, start, "wind_speed", val,
-                                         f"Wiatr powyżej {ALERT_WIND_THRESHOLD} m/s od {hour_str} przez {hours}h")
-
-            # --- agregacja opadów ---
-            precip_flags = []
-            for i in range(len(times)):
-                rain = rains[i]
-                snow = snows[i]
-                code = codes[i]
-                precip = False
-                val = 0.0
-                if rain is not None and float(rain) > 0:
-                    precip = True
-                    val = float(rain)
-                if snow is not None and float(snow) > 0:
-                    precip = True
-                    val = float(snow) if val == 0.0 else val
-                if not precip and code is not None and int(code) in ALERT_WEATHER_CODES_PRECIP:
-                    precip = True
-                precip_flags.append(val if precip else None)
-
-            precip_series = _aggregate_series(times, precip_flags, lambda v: v is not None)
-            for start, hours, val in precip_series:
-                hour_str = _extract_hour(start)
-                added += insert_alert_db(conn, location_id, start, "precipitation", val,
-                                         f"Opady od {hour_str} przez {hours}h")
-
-        # obsługa hourly i minutely_15
-        process_block(payload.get("hourly", {}))
-        process_block(payload.get("minutely_15", {}))
+    if t_start is not None:
+        temp_runs.append((t_start, t_count, t_val))
+    if w_start is not None:
+        wind_runs.append((w_start, w_count, w_val))
+    if p_start is not None:
+        precip_runs.append((p_start, p_count, p_val))
+    return temp_runs, wind_runs, precip_runs
 
+
+def _is_in_range(t_dt: datetime | None, now: datetime, max_dt: datetime) -> bool:
+    try:
+        return t_dt is not None and now <= t_dt <= max_dt
     except Exception:
-        LOGGER.exception("Błąd podczas analizy payloadu")
-    return added
+        return False
 
+
+def _process_block(location_id: int, key: str, block: Dict[str, Any], now: datetime, max_dt: datetime,
+                   alerts_batch: List[Tuple]) -> None:
+    """Przeanalizuj blok `key` payloadu (`hourly` / `minutely_15`) i dopisz alerty do `alerts_batch`."""
+    times = block.get("time", ())
+    if not times:
+        return
+    temps = block.get("temperature_2m", ())
+    winds = block.get("wind_speed_10m", ())
+    rains = block.get("rain", ())
+    snows = block.get("snowfall", ())
+    codes = block.get("weather_code") or block.get("weathercode") or ()
+
+    # każdy timestamp parsujemy dokładnie raz (zakres + origin alertu)
+    parsed = [_parse_ts(ts) for ts in times]
+
+    # filtrujemy tylko czasy w zakresie - maska liczona jednym przebiegiem;
+    # wolna ścieżka tylko gdy blok miesza naive/aware datetime
+    try:
+        in_range = [t_dt is not None and now <= t_dt <= max_dt for t_dt in parsed]
+    except TypeError:
+        in_range = [_is_in_range(t_dt, now, max_dt) for t_dt in parsed]
+    times = list(compress(times, in_range))
+    parsed_by_ts = dict(zip(times, compress(parsed, in_range)))
+    temps = _as_floats(_select(temps, in_range))
+    winds = _as_floats(_select(winds, in_range))
+    rains = _as_floats(_select(rains, in_range))
+    snows = _as_floats(_select(snows, in_range))
+    codes = [int(c) if c is not None else None for c in _select(codes, in_range)]
+
+    # --- wartości opadów (None = brak opadów) ---
+    precip_flags = []
+    append = precip_flags.append
+    codes_mask = _CODES_MASK
+    for rain, snow, code in zip(rains, snows, codes):
+        r = rain if rain is not None else 0.0
+        s = snow if snow is not None else 0.0
+        c = code if code is not None else -1
+        precip = r > 0 or s > 0 or (c >= 0 and (codes_mask >> c) & 1)
+        # wartość: deszcz, a gdy go brak - śnieg
+        append((r if r > 0 else s if s > 0 else 0.0) if precip else None)
+
+    # --- agregacja temperatury, wiatru i opadów w jednym przebiegu ---
+    temp_series, wind_series, precip_series = _fused_aggregate(times, temps, winds, precip_flags)
+    prefixes = _MSG_PREFIXES[key]
+    step = _BLOCK_STEP_MIN[key]
+    for metric, series in (("temperature", temp_series), ("wind_speed", wind_series),
+                           ("precipitation", precip_series)):
+        prefix = prefixes[metric]
+        for start, count, val in series:
+            # czas trwania w jednostkach bloku: godziny dla hourly, minuty dla minutely_15
+            duration = f"{count}h" if step == 60 else f"{count * step} min"
+            alerts_batch.append(_build_alert_row(location_id, start, parsed_by_ts[start], metric, val,
+                                                 f"{prefix}{_extract_hour(start)} przez {duration}", now))
+
+
+def analyze_payload_and_alert(conn: sqlite3.Connection, location_id: int, payload: Dict[str, Any],
+                              now: datetime | None = None) -> int:
+    alerts_batch: List[Tuple] = []
+    # `now` (UTC) może podać wywołujący - jedna wartość dla całego cyklu pobrania
+    if now is None:
+        now = datetime.utcnow()
+    max_dt = now + timedelta(days=2)
+    # obsługa hourly i minutely_15 tą samą ścieżką; błąd w jednym bloku
+    # (np. nienumeryczna wartość) nie przerywa analizy drugiego
+    for key in ("hourly", "minutely_15"):
+        try:
+            _process_block(location_id, key, payload.get(key, {}), now, max_dt, alerts_batch)
+        except Exception:
+            LOGGER.exception("Błąd podczas analizy bloku %s payloadu", key)
+    # jeden executemany + jeden commit zamiast commita po każdym alercie
+    return insert_alerts_db(conn, alerts_batch)
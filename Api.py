@@ -1,13 +1,33 @@
 from pathlib import Path
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import repeat
 from datetime import datetime
 import logging
 import os
+import queue
+import threading
+import atexit
+from collections import OrderedDict
 from save_json import save_payload_to_json
 import Alert
 
+try:
+    # szybszy parser JSON (opcjonalny); bez niego używamy r.json()
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # cache odpowiedzi HTTP (opcjonalny) - powtórne zapytania w oknie ważności nie idą do sieci
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
 
 DB_PATH = Path("data/meteodata.db")
 
@@ -47,6 +67,18 @@ MINUTELY_15_VARS = ",".join([
     "wind_direction_10m",
     "weather_code",
 ])
+# parametry wspólne dla wszystkich lokalizacji - składane raz, przy imporcie
+_BASE_PARAMS = {**DEFAULT_PARAMS, "minutely_15": MINUTELY_15_VARS}
+
+# Wspólna sesja HTTP: keep-alive i pula połączeń do api.open-meteo.com
+# współdzielone przez wątki pobierające lokalizacje równolegle
+SESSION = requests.Session()
+# ponowienia GET robi adapter (backoff 1 s, 2 s; 429/5xx z poszanowaniem Retry-After) -
+# bez własnej pętli ze sleep; POST-y webhooków nie są ponawiane
+_RETRY = Retry(total=2, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+               allowed_methods=("GET",), raise_on_status=False)
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=_RETRY))
+FETCH_WORKERS = 8
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 logger = logging.getLogger("meteofetch")
@@ -56,37 +88,96 @@ logger = logging.getLogger("meteofetch")
 ALERT_WIND_THRESHOLD = 58.0  # m/s - próg wysoki wiatr (zgodnie z prośbą)
 ALERT_TEMP_LOW_THRESHOLD = -10.0  # °C - przyjmujemy, że poniżej tej wartości alarmujemy
 # Jeżeli występują opady deszczu/sniegu > 0 lub weather_code wskazuje opady -> alert
-ALERT_WEATHER_CODES_PRECIP = {51, 53, 55, 61, 63, 65, 80, 81, 82, 95}
-
-
-def insert_alert(conn: sqlite3.Connection, location_id: int, timestamp: str | None, metric: str, value: float, message: str, origin: str | None = None) -> None:
-    """Wstaw prosty alert do tabeli `alerts`.
+# kody opadów i ich bitmaska wspólne z modułem Alert - obie ścieżki alertów
+# korzystają z jednej definicji
+ALERT_WEATHER_CODES_PRECIP = Alert.ALERT_WEATHER_CODES_PRECIP
+_PRECIP_MASK = Alert._CODES_MASK
+
+# Stałe teksty SQL - identyczny tekst przy każdym wywołaniu (i dla każdej
+# lokalizacji) trafia w cache przygotowanych zapytań połączenia
+_SQL_INSERT_ALERT = "INSERT INTO alerts (location_id, timestamp, metric, value, message, origin) VALUES (?, ?, ?, ?, ?, ?)"
+_SQL_INSERT_HOURLY = "INSERT INTO hourly (location_id, timestamp, temperature, rain, snowfall, wind_speed, weather_code, wind_direction, uv_index) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+# pierwszy zapis lokalizacji: duplikaty (location_id, timestamp) pomijamy - tylko konflikt
+# klucza, bez ukrywania innych naruszeń ograniczeń jak przy OR IGNORE
+_SQL_INSERT_HOURLY_FIRST = _SQL_INSERT_HOURLY + " ON CONFLICT(location_id, timestamp) DO NOTHING"
+_SQL_INSERT_MINUTELY = "INSERT INTO minutely15 (location_id, timestamp, temperature, wind_speed, rain, snowfall, wind_direction, weather_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_SQL_INSERT_MINUTELY_FIRST = _SQL_INSERT_MINUTELY + " ON CONFLICT(location_id, timestamp) DO NOTHING"
+# ostatni wiersz lokalizacji razem z jego timestampem: ORDER BY ... DESC LIMIT 1 to jedno
+# zejście indeksem (location_id, timestamp) od końca, bez osobnego zapytania o MAX(timestamp)
+_SQL_LAST_HOURLY = "SELECT timestamp, temperature, rain, snowfall, wind_speed FROM hourly WHERE location_id=? ORDER BY timestamp DESC LIMIT 1"
+_SQL_LAST_MINUTELY = "SELECT timestamp, temperature, wind_speed, rain, snowfall FROM minutely15 WHERE location_id=? ORDER BY timestamp DESC LIMIT 1"
+
+
+def _alert_row(location_id: int, timestamp: str | None, metric: str, value: float, message: str,
+               origin: str | None = None, now: datetime | None = None) -> tuple:
+    """Zbuduj krotkę alertu do wstawienia do tabeli `alerts`.
 
     Jeśli `origin` nie zostanie podany, próbujemy je wyznaczyć z pola `timestamp`:
       - jeśli timestamp > teraz => origin='predicted'
       - w przeciwnym razie => origin='historical'
       - jeśli parsowanie się nie powiedzie => origin='detected'
     """
-    try:
-        # wyznacz origin jeśli nie podano
-        if origin is None:
-            origin = "detected"
-            try:
-                if timestamp:
-                    t_dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-                    origin = "predicted" if t_dt > datetime.utcnow() else "historical"
-            except Exception:
-                pass
-        cur = conn.cursor()
-        cur.execute("INSERT INTO alerts (location_id, timestamp, metric, value, message, origin) VALUES (?, ?, ?, ?, ?, ?)", (location_id, timestamp, metric, value, message, origin))
-        conn.commit()
-        logger.warning("ALERT: %s (loc=%d) %s=%.2f origin=%s", message, location_id, metric, value, origin)
-    except Exception:
-        logger.exception("Nie udało się zapisać alertu")
-    # Opcjonalne wysłanie powiadomienia przez webhook (zmienna środowiskowa ALERT_WEBHOOK_URL)
+    if origin is None:
+        origin = "detected"
+        try:
+            if timestamp:
+                t_dt = Alert._parse_iso(timestamp)
+                origin = "predicted" if t_dt > (now or datetime.utcnow()) else "historical"
+        except Exception:
+            pass
+    return (location_id, timestamp, metric, value, message, origin)
+
+
+# Powiadomienia webhook wysyła osobny wątek - zapis do bazy nie czeka na sieć.
+_webhook_q: "queue.Queue[tuple[str, dict]]" = queue.Queue()
+_webhook_thread: threading.Thread | None = None
+_webhook_lock = threading.Lock()
+# klucze (location_id, timestamp, metric) już zgłoszonych alertów - ten sam alert
+# nie jest wysyłany drugi raz; rozmiar ograniczony jak w LRU
+_WEBHOOK_SENT_MAX = 10_000
+_webhook_sent: "OrderedDict[tuple, None]" = OrderedDict()
+
+
+def _webhook_worker() -> None:
+    while True:
+        webhook, payload = _webhook_q.get()
+        try:
+            SESSION.post(webhook, json=payload, timeout=5)
+        except Exception:
+            logger.exception("Nie udało się wysłać powiadomienia webhook")
+        finally:
+            _webhook_q.task_done()
+
+
+def flush_webhooks(timeout: float = 10.0) -> None:
+    """Poczekaj (najwyżej `timeout` sekund) aż kolejka powiadomień webhook się opróżni."""
+    deadline = time.monotonic() + timeout
+    while _webhook_q.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def _notify_webhook(row: tuple) -> None:
+    """Opcjonalne wysłanie powiadomienia przez webhook (zmienna środowiskowa ALERT_WEBHOOK_URL).
+
+    Powiadomienie trafia do kolejki obsługiwanej przez wątek w tle.
+    """
+    global _webhook_thread
     try:
         webhook = os.environ.get("ALERT_WEBHOOK_URL")
         if webhook:
+            location_id, timestamp, metric, value, message, origin = row
+            key = (location_id, timestamp, metric)
+            with _webhook_lock:
+                if key in _webhook_sent:
+                    return
+                _webhook_sent[key] = None
+                if len(_webhook_sent) > _WEBHOOK_SENT_MAX:
+                    _webhook_sent.popitem(last=False)
+                if _webhook_thread is None:
+                    _webhook_thread = threading.Thread(target=_webhook_worker, name="alert-webhook", daemon=True)
+                    _webhook_thread.start()
+                    # przy wyjściu z programu (np. tryb jednorazowy) dajemy szansę dosłać kolejkę
+                    atexit.register(flush_webhooks)
             payload = {
                 "location_id": location_id,
                 "timestamp": timestamp,
@@ -95,16 +186,34 @@ def insert_alert(conn: sqlite3.Connection, location_id: int, timestamp: str | No
                 "message": message,
                 "origin": origin,
             }
-            # bezpieczne wysłanie POST, nie blokujemy głównego procesu na długi czas
-            try:
-                requests.post(webhook, json=payload, timeout=5)
-            except Exception:
-                logger.exception("Nie udało się wysłać powiadomienia webhook")
+            _webhook_q.put((webhook, payload))
     except Exception:
         # Nie dopuszczamy żeby błąd powiadomienia przerwał logikę zapisu
         logger.exception("Błąd przy próbie przygotowania powiadomienia")
 
 
+def insert_alerts(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    """Wstaw wiele alertów (krotek z `_alert_row`) jednym `executemany`.
+
+    Nie zatwierdza transakcji - commit wykonuje wywołujący (raz na lokalizację).
+    """
+    if not rows:
+        return
+    try:
+        conn.executemany(_SQL_INSERT_ALERT, rows)
+        for location_id, _, metric, value, message, origin in rows:
+            logger.warning("ALERT: %s (loc=%d) %s=%.2f origin=%s", message, location_id, metric, value, origin)
+    except Exception:
+        logger.exception("Nie udało się zapisać alertów")
+    for row in rows:
+        _notify_webhook(row)
+
+
+def insert_alert(conn: sqlite3.Connection, location_id: int, timestamp: str | None, metric: str, value: float, message: str, origin: str | None = None) -> None:
+    """Wstaw pojedynczy alert do tabeli `alerts` (origin jak w `_alert_row`)."""
+    insert_alerts(conn, [_alert_row(location_id, timestamp, metric, value, message, origin)])
+
+
 def ensure_dirs():
     """Upewnij się, że katalog `data/` istnieje."""
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -170,203 +279,492 @@ def init_db(conn: sqlite3.Connection):
         )
         """
     )
-    conn.commit()
+    # hourly/minutely15: UNIQUE(location_id, timestamp) już obsługuje MAX(timestamp)
+    # i ORDER BY timestamp DESC LIMIT 1 wyszukiwaniem w indeksie - osobny indeks DESC
+    # tylko spowolniłby zapisy. Alerty nie mają żadnego indeksu.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_alerts_loc_ts ON alerts(location_id, timestamp)")
     # migracja: jeśli tabela istnieje bez kolumny origin, dodajemy ją
     try:
         cur.execute("PRAGMA table_info(alerts)")
         existing = [r[1] for r in cur.fetchall()]
         if "origin" not in existing:
             cur.execute("ALTER TABLE alerts ADD COLUMN origin TEXT")
-            conn.commit()
     except Exception:
         logger.exception("Nie udało się sprawdzić/migrować tabeli alerts")
+    # statystyki dla planera (sqlite_stat1) - PRAGMA optimize uruchamia ANALYZE tylko gdy trzeba
+    conn.execute("PRAGMA optimize")
+
+
+# PRAGMA ustawiane raz, przy otwarciu połączenia; page_size działa tylko dla nowej
+# (pustej) bazy i musi poprzedzać przejście na WAL
+_CONN_BOOTSTRAP_SQL = """
+PRAGMA page_size=8192;
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-20000;
+"""
+
+_conn_cache: dict[str, sqlite3.Connection] = {}
+# id lokalizacji (nazwa -> id) per baza; zbiór LOCATIONS jest stały, więc
+# wystarczy wczytać go raz przy otwarciu połączenia
+_location_ids: dict[str, dict[str, int]] = {}
+
+
+def _get_conn(db_path: Path) -> sqlite3.Connection:
+    """Zwróć połączenie do bazy współdzielone między kolejnymi pobraniami.
+
+    Przy pierwszym otwarciu ustawia PRAGMA i tworzy schemat; w trybie ciągłym
+    kolejne iteracje korzystają z tego samego (rozgrzanego) połączenia.
+    """
+    key = str(db_path)
+    conn = _conn_cache.get(key)
+    if conn is None:
+        # tryb autocommit: moduł sqlite3 nie otwiera niejawnych transakcji,
+        # granice transakcji wyznaczają jawne BEGIN/COMMIT
+        conn = sqlite3.connect(key, isolation_level=None)
+        conn.executescript(_CONN_BOOTSTRAP_SQL)
+        init_db(conn)
+        _location_ids[key] = _load_location_ids(conn)
+        _conn_cache[key] = conn
+    return conn
+
+
+@atexit.register
+def _close_conns() -> None:
+    """Zamknij połączenia z `_conn_cache` przy wyjściu z procesu.
+
+    PRAGMA optimize aktualizuje statystyki planera; zamknięcie ostatniego połączenia
+    robi checkpoint i usuwa pliki -wal/-shm.
+    """
+    for conn in _conn_cache.values():
+        try:
+            conn.execute("PRAGMA optimize")
+            conn.close()
+        except sqlite3.Error:
+            logger.exception("Nie udało się zamknąć połączenia z bazą")
+    _conn_cache.clear()
+    _location_ids.clear()
+
+
+def _load_location_ids(conn: sqlite3.Connection) -> dict[str, int]:
+    """Dodaj brakujące LOCATIONS jednym executemany i zwróć mapę nazwa -> id."""
+    # w trybie autocommit każdy wiersz byłby osobną transakcją - jedna na całość
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT OR IGNORE INTO locations (name, latitude, longitude) VALUES (?, ?, ?)",
+        [(loc["name"], loc["latitude"], loc["longitude"]) for loc in LOCATIONS],
+    )
+    conn.commit()
+    return {name: loc_id for loc_id, name in conn.execute("SELECT id, name FROM locations")}
+
+
+# UPSERT z RETURNING (SQLite >= 3.35) zwraca id w jednym zapytaniu - także dla istniejącej lokalizacji
+_SQL_UPSERT_LOCATION = (
+    "INSERT INTO locations (name, latitude, longitude) VALUES (?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET name=excluded.name RETURNING id"
+)
 
 
 def insert_or_get_location(conn: sqlite3.Connection, loc: dict) -> int:
     """Zwróć id lokalizacji; dodaj rekord jeśli nie istnieje."""
     cur = conn.cursor()
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        cur.execute(_SQL_UPSERT_LOCATION, (loc["name"], loc["latitude"], loc["longitude"]))
+        return cur.fetchone()[0]
     cur.execute("SELECT id FROM locations WHERE name=?", (loc["name"],))
     row = cur.fetchone()
     if row:
         return row[0]
     cur.execute("INSERT INTO locations (name, latitude, longitude) VALUES (?, ?, ?)", (loc["name"], loc["latitude"], loc["longitude"]))
-    conn.commit()
     return cur.lastrowid
 
 
-def fetch_location(location: dict) -> dict:
-    """Pobierz dane z API Open-Meteo dla podanej lokalizacji (z retry/backoff)."""
-    params = {"latitude": location["latitude"], "longitude": location["longitude"], **DEFAULT_PARAMS}
-    params["minutely_15"] = MINUTELY_15_VARS
-    attempts = 3
-    backoff = 1
-    for attempt in range(attempts):
-        try:
-            logger.info("Pobieram %s", location["name"])
-            r = requests.get(API_URL, params=params, timeout=30)
-            r.raise_for_status()
-            return r.json()
-        except requests.RequestException as e:
-            logger.warning("Błąd sieci dla %s (attempt %d): %s", location["name"], attempt + 1, e)
-            time.sleep(backoff)
-            backoff *= 2
-    raise RuntimeError(f"Nie udało się pobrać danych dla {location['name']}")
-
-
-def store_hourly(conn: sqlite3.Connection, location_id: int, payload: dict) -> int:
-    """Zapisz tablice `hourly` do tabeli `hourly`. Zwraca liczbę wstawionych wierszy."""
+def _prepare_location_request(location: dict) -> requests.PreparedRequest:
+    params = {"latitude": location["latitude"], "longitude": location["longitude"], **_BASE_PARAMS}
+    return SESSION.prepare_request(requests.Request("GET", API_URL, params=params))
+
+
+# LOCATIONS są stałe - zapytania (URL z zakodowanymi parametrami, nagłówki sesji)
+# przygotowujemy raz, przy imporcie; klucz to współrzędne lokalizacji. Ciasteczka
+# i ustawienia środowiska dokładamy przy każdym wysłaniu (`_send_prepared`)
+_PREPARED: dict[tuple[float, float], requests.PreparedRequest] = {
+    (loc["latitude"], loc["longitude"]): _prepare_location_request(loc) for loc in LOCATIONS
+}
+
+
+def _send_prepared(prepared: requests.PreparedRequest, headers: dict, session: requests.Session) -> requests.Response:
+    """Wyślij kopię gotowego zapytania przez `session` z bieżącym stanem sesji."""
+    req = prepared.copy()
+    req.headers.update(headers)
+    # ciasteczka z chwili wysłania, nie z chwili importu
+    req.headers.pop("Cookie", None)
+    req.prepare_cookies(session.cookies)
+    # ustawienia ze środowiska (proxy, certyfikaty), które `Session.get` dołącza sam, a `send` nie
+    settings = session.merge_environment_settings(req.url, {}, None, None, None)
+    return session.send(req, timeout=30, **settings)
+
+
+# sesje z cache odpowiedzi (requests_cache) per plik cache - tworzone przy pierwszym
+# pobraniu do danej bazy, nie przy imporcie
+_http_sessions: dict[str, requests.Session] = {}
+
+
+def _http_session(db_path: Path) -> requests.Session:
+    """Sesja do pobierania danych zapisywanych w `db_path`.
+
+    Z requests_cache: odpowiedzi 200 trzymane przez 30 minut w `http_cache.sqlite`
+    obok bazy, więc kolejny proces (np. uruchomienie z crona) nie pyta API ponownie.
+    Bez requests_cache: wspólna sesja `SESSION`.
+    """
+    if requests_cache is None:
+        return SESSION
+    cache_name = str(db_path.parent / "http_cache")
+    session = _http_sessions.get(cache_name)
+    if session is None:
+        session = requests_cache.CachedSession(cache_name, expire_after=1800, allowable_codes=(200,))
+        session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=_RETRY))
+        _http_sessions[cache_name] = session
+    return session
+
+
+# walidatory HTTP (ETag, Last-Modified) ostatniej odpowiedzi, której dane zapisano -
+# klucz (baza, lokalizacja, fetch_hourly, fetch_minutely); kolejne zapytania są
+# warunkowe, a 304 oznacza brak zmian w danych
+_http_validators: dict[tuple[str, str, bool, bool], tuple[str | None, str | None]] = {}
+
+
+def fetch_location(location: dict, session: requests.Session | None = None,
+                   validators: tuple[str | None, str | None] | None = None) -> dict | None:
+    """Pobierz dane z API Open-Meteo dla podanej lokalizacji (retry/backoff w adapterze sesji).
+
+    Domyślnie korzysta ze wspólnej sesji `SESSION`. Z podanymi `validators`
+    (ETag, Last-Modified) zapytanie jest warunkowe - wtedy zwraca None, gdy serwer
+    odpowie 304 (dane nie zmieniły się od poprzedniego pobrania).
+    """
+    return _fetch_location(location, session, validators)[0]
+
+
+def _fetch_location(location: dict, session: requests.Session | None,
+                    validators: tuple[str | None, str | None] | None) -> tuple[dict | None, tuple[str | None, str | None] | None]:
+    """Jak `fetch_location`, ale zwraca też walidatory odpowiedzi (None gdy ich brak).
+
+    Walidatorów nie zapamiętuje - robi to wywołujący dopiero po zapisaniu danych.
+    """
+    if session is None:
+        session = SESSION
+    # gotowe zapytanie tylko dla sesji tego modułu - inna sesja może mieć inne nagłówki
+    own = session is SESSION or session in _http_sessions.values()
+    prepared = _PREPARED.get((location["latitude"], location["longitude"])) if own else None
+    headers = {}
+    etag, last_modified = validators or (None, None)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    if headers:
+        # zapytanie warunkowe idzie do serwera z pominięciem cache requests_cache -
+        # inaczej świeży wpis z cache wróciłby jako 200 i 304 nigdy by nie dotarło
+        headers["Cache-Control"] = "no-cache"
+    try:
+        logger.info("Pobieram %s", location["name"])
+        if prepared is not None:
+            r = _send_prepared(prepared, headers, session)
+        else:
+            params = {"latitude": location["latitude"], "longitude": location["longitude"], **_BASE_PARAMS}
+            r = session.get(API_URL, params=params, headers=headers, timeout=30)
+        if r.status_code == 304:
+            logger.info("Brak zmian dla %s (304)", location["name"])
+            return None, None
+        r.raise_for_status()
+        payload = orjson.loads(r.content) if orjson is not None else r.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("Błąd pobierania dla %s: %s", location["name"], e)
+        raise RuntimeError(f"Nie udało się pobrać danych dla {location['name']}") from e
+    if "ETag" in r.headers or "Last-Modified" in r.headers:
+        return payload, (r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    return payload, None
+
+
+def _safe_float(value) -> float | None:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _safe_int(value) -> int | None:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _floats(values) -> list[float | None]:
+    """Zamień kolumnę na float/None; wolna ścieżka tylko gdy trafi się nienumeryczna wartość."""
+    try:
+        return [float(v) if v is not None else None for v in values]
+    except (TypeError, ValueError):
+        return [_safe_float(v) for v in values]
+
+
+def _new_rows(times, max_ts: str | None) -> range | list[int]:
+    """Indeksy wierszy nowszych niż `max_ts`.
+
+    Nowe wiersze to zwykle ciągły koniec osi czasu - wtedy zwracamy `range`,
+    dla którego `_column` wycina kolumny plasterkiem zamiast indeksować po elemencie.
+    """
+    if max_ts is None:
+        return range(len(times))
+    idx = [i for i, t in enumerate(times) if t > max_ts]
+    if idx and idx[-1] - idx[0] + 1 == len(idx):
+        return range(idx[0], idx[-1] + 1)
+    return idx
+
+
+def _column(values, idx) -> list:
+    """Wybierz z kolumny pozycje `idx`; brakujące na końcu kolumny uzupełnij None."""
+    if isinstance(idx, range):
+        col = list(values[idx.start:idx.stop])
+        if len(col) < len(idx):
+            col.extend(repeat(None, len(idx) - len(col)))
+        return col
+    n = len(values)
+    return [values[i] if i < n else None for i in idx]
+
+
+def _ffill(values, idx, last) -> list:
+    """Jak `_column`, ale None zastępuje ostatnią znaną wartością (startując od `last`)."""
+    col = _column(values, idx)
+    # typowo kolumna nie ma luk - sprawdzenie `in` odbywa się w C, bez pętli w Pythonie
+    if None not in col:
+        return col
+    for i, v in enumerate(col):
+        if v is None:
+            col[i] = last
+        else:
+            last = v
+    return col
+
+
+def _runs(mask: list[bool]) -> list[tuple[int, int]]:
+    """Zwróć przedziały (start, koniec włącznie) kolejnych pozycji z prawdą w masce."""
+    runs = []
+    start = None
+    for i, hit in enumerate(mask):
+        if hit:
+            if start is None:
+                start = i
+        elif start is not None:
+            runs.append((start, i - 1))
+            start = None
+    if start is not None:
+        runs.append((start, len(mask) - 1))
+    return runs
+
+
+def _detect_alerts(location_id: int, times, temps, winds, rains, snows, codes, now: datetime) -> list[tuple]:
+    """Wykryj nietypowe wartości w kolumnach wierszy i zwróć krotki alertów.
+
+    Progi sprawdzane są maskami dla całej kolumny naraz; kolejne wiersze z tym
+    samym przekroczeniem dają jeden alert na cały przedział (timestamp = początek,
+    wartość = najbardziej skrajna w przedziale). Kolejność: wiatr, temperatura, opady.
+    """
+    temps_f = _floats(temps)
+    winds_f = _floats(winds)
+    rains_f = _floats(rains)
+    snows_f = _floats(snows)
+    wind_mask = [v is not None and v > ALERT_WIND_THRESHOLD for v in winds_f]
+    temp_mask = [v is not None and v <= ALERT_TEMP_LOW_THRESHOLD for v in temps_f]
+    # opady: jeśli mamy bezwzględne wartości deszczu/śniegu > 0 lub weather_code wskazuje opady
+    codes_i = [_safe_int(c) for c in codes]
+    precip_mask = [
+        (r is not None and r > 0) or (s is not None and s > 0)
+        or (c is not None and c >= 0 and (_PRECIP_MASK >> c) & 1 == 1)
+        for r, s, c in zip(rains_f, snows_f, codes_i)
+    ]
+    alerts = []
+    for start, end in _runs(wind_mask):
+        alerts.append(_alert_row(location_id, times[start], "wind_speed", max(winds_f[start:end + 1]),
+                                 f"Wiatr przekroczył {ALERT_WIND_THRESHOLD} m/s ({times[start]} - {times[end]})", now=now))
+    for start, end in _runs(temp_mask):
+        alerts.append(_alert_row(location_id, times[start], "temperature", min(temps_f[start:end + 1]),
+                                 f"Temperatura poniżej {ALERT_TEMP_LOW_THRESHOLD} °C ({times[start]} - {times[end]})", now=now))
+    for start, end in _runs(precip_mask):
+        value = max((rains_f[i] or snows_f[i] or 0.0) for i in range(start, end + 1))
+        alerts.append(_alert_row(location_id, times[start], "precipitation", value,
+                                 f"Wykryto możliwe opady ({times[start]} - {times[end]})", now=now))
+    return alerts
+
+
+def store_hourly(conn: sqlite3.Connection, location_id: int, payload: dict, alerts: list[tuple] | None = None,
+                 now: datetime | None = None) -> int:
+    """Zapisz tablice `hourly` do tabeli `hourly`. Zwraca liczbę wstawionych wierszy.
+
+    Nie zatwierdza transakcji - commit wykonuje wywołujący. Jeśli podano `alerts`,
+    wykryte alerty są do niej dopisywane zamiast od razu zapisywane. `now` (UTC) to
+    chwila odniesienia dla origin alertów - domyślnie bieżący czas.
+    """
     hourly = payload.get("hourly", {})
     times = hourly.get("time", [])
     if not times:
         return 0
-    def arr(name):
-        return hourly.get(name, [])
-    temps = arr("temperature_2m")
-    rains = arr("rain")
-    snows = arr("snowfall")
-    wind = arr("wind_speed_10m")
-    codes = arr("weather_code") or arr("weathercode")
-    dirs = arr("wind_direction_10m")
-    uvs = arr("uv_index")
+    temps = hourly.get("temperature_2m", ())
+    rains = hourly.get("rain", ())
+    snows = hourly.get("snowfall", ())
+    wind = hourly.get("wind_speed_10m", ())
+    codes = hourly.get("weather_code") or hourly.get("weathercode") or ()
+    dirs = hourly.get("wind_direction_10m", ())
+    uvs = hourly.get("uv_index", ())
     cur = conn.cursor()
-    cur.execute("SELECT MAX(timestamp) FROM hourly WHERE location_id=?", (location_id,))
-    r = cur.fetchone()
-    max_ts = r[0] if r and r[0] is not None else None
-    rows = []
-    for i, t in enumerate(times):
-        if max_ts is not None and t <= max_ts:
-            continue
-        # Obsługa brakujących danych: jeśli wartość jest None, spróbuj użyć ostatniej znanej wartości z bazy
-        def last_or(value, col_name):
-            if value is not None:
-                return value
-            cur2 = conn.cursor()
-            try:
-                cur2.execute(f"SELECT {col_name} FROM hourly WHERE location_id=? ORDER BY timestamp DESC LIMIT 1", (location_id,))
-                row2 = cur2.fetchone()
-                return row2[0] if row2 else None
-            finally:
-                cur2.close()
-
-        t_temp = last_or(temps[i] if i < len(temps) else None, "temperature")
-        t_rain = last_or(rains[i] if i < len(rains) else None, "rain")
-        t_snow = last_or(snows[i] if i < len(snows) else None, "snowfall")
-        t_wind = last_or(wind[i] if i < len(wind) else None, "wind_speed")
-        t_code = codes[i] if i < len(codes) else None
-        t_dir = dirs[i] if i < len(dirs) else None
-        t_uv = uvs[i] if i < len(uvs) else None
-        rows.append((location_id, t, t_temp, t_rain, t_snow, t_wind, t_code, t_dir, t_uv))
-        # Alerty: wykryj nietypowe wartości
-        try:
-            # wiatr
-            if t_wind is not None and float(t_wind) > ALERT_WIND_THRESHOLD:
-                insert_alert(conn, location_id, t, "wind_speed", float(t_wind), f"Wiatr przekroczył {ALERT_WIND_THRESHOLD} m/s")
-            # niska temperatura
-            if t_temp is not None:
-                try:
-                    if float(t_temp) <= ALERT_TEMP_LOW_THRESHOLD:
-                        insert_alert(conn, location_id, t, "temperature", float(t_temp), f"Temperatura poniżej {ALERT_TEMP_LOW_THRESHOLD} °C")
-                except Exception:
-                    logger.exception("Błąd przy sprawdzaniu progu temperatury (hourly)")
-            # opady: jeśli mamy bezwzględne wartości deszczu/śniegu > 0 lub weather_code wskazuje opady
-            try:
-                precip = False
-                if t_rain is not None and float(t_rain) > 0:
-                    precip = True
-                if t_snow is not None and float(t_snow) > 0:
-                    precip = True
-                if t_code is not None:
-                    try:
-                        if int(t_code) in ALERT_WEATHER_CODES_PRECIP:
-                            precip = True
-                    except Exception:
-                        pass
-                if precip:
-                    insert_alert(conn, location_id, t, "precipitation", float(t_rain or t_snow or 0.0), "Wykryto możliwe opady")
-            except Exception:
-                logger.exception("Błąd przy sprawdzaniu opadów (hourly)")
-        except Exception:
-            logger.exception("Błąd przy sprawdzaniu alertów (hourly)")
-    if rows:
-        cur.executemany("INSERT OR REPLACE INTO hourly (location_id, timestamp, temperature, rain, snowfall, wind_speed, weather_code, wind_direction, uv_index) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
-        conn.commit()
-    return len(rows)
-
-
-def store_minutely15(conn: sqlite3.Connection, location_id: int, payload: dict) -> int:
-    """Zapisz dane 15-minutowe `minutely_15` do tabeli `minutely15`. Zwraca liczbę wierszy."""
+    # ostatni zapisany wiersz - jedno zapytanie zamiast jednego na każdą brakującą wartość;
+    # jego timestamp to zarazem max_ts
+    cur.execute(_SQL_LAST_HOURLY, (location_id,))
+    max_ts, last_temp, last_rain, last_snow, last_wind = cur.fetchone() or (None, None, None, None, None)
+    # indeksy nowych wierszy; dalej budujemy całe kolumny, a wiersze składamy jednym zip
+    idx = _new_rows(times, max_ts)
+    if not idx:
+        return 0
+    r_times = _column(times, idx)
+    # Obsługa brakujących danych: jeśli wartość jest None, użyj ostatniej znanej wartości
+    # (z bazy albo z wcześniejszego wiersza tego payloadu)
+    r_temps = _ffill(temps, idx, last_temp)
+    r_rains = _ffill(rains, idx, last_rain)
+    r_snows = _ffill(snows, idx, last_snow)
+    r_winds = _ffill(wind, idx, last_wind)
+    r_codes = _column(codes, idx)
+    # wiersze składa leniwy zip - executemany pobiera je kolejno, bez listy wszystkich krotek
+    rows = zip(repeat(location_id), r_times, r_temps, r_rains, r_snows, r_winds,
+               r_codes, _column(dirs, idx), _column(uvs, idx))
+    # wiersze są nowsze niż max_ts, więc nie ma czego zastępować; przy pierwszym
+    # zapisie (max_ts is None) pomijamy ewentualne duplikaty w samym payloadzie
+    cur.executemany(_SQL_INSERT_HOURLY if max_ts is not None else _SQL_INSERT_HOURLY_FIRST, rows)
+    # Alerty: wykryj nietypowe wartości
+    detected = _detect_alerts(location_id, r_times, r_temps, r_winds, r_rains, r_snows, r_codes, now or datetime.utcnow())
+    if alerts is not None:
+        alerts.extend(detected)
+    else:
+        insert_alerts(conn, detected)
+    return len(r_times)
+
+
+def store_minutely15(conn: sqlite3.Connection, location_id: int, payload: dict, alerts: list[tuple] | None = None,
+                     now: datetime | None = None) -> int:
+    """Zapisz dane 15-minutowe `minutely_15` do tabeli `minutely15`. Zwraca liczbę wierszy.
+
+    Nie zatwierdza transakcji - commit wykonuje wywołujący. Jeśli podano `alerts`,
+    wykryte alerty są do niej dopisywane zamiast od razu zapisywane. `now` jak w `store_hourly`.
+    """
     minutely = payload.get("minutely_15", {})
     times = minutely.get("time", [])
     if not times:
         return 0
-    def arr(name):
-        return minutely.get(name, [])
-    temps = arr("temperature_2m")
-    wind = arr("wind_speed_10m")
-    rains = arr("rain")
-    snows = arr("snowfall")
-    dirs = arr("wind_direction_10m")
-    codes = arr("weather_code") or arr("weathercode")
+    temps = minutely.get("temperature_2m", ())
+    wind = minutely.get("wind_speed_10m", ())
+    rains = minutely.get("rain", ())
+    snows = minutely.get("snowfall", ())
+    dirs = minutely.get("wind_direction_10m", ())
+    codes = minutely.get("weather_code") or minutely.get("weathercode") or ()
     cur = conn.cursor()
-    cur.execute("SELECT MAX(timestamp) FROM minutely15 WHERE location_id=?", (location_id,))
-    r = cur.fetchone()
-    max_ts = r[0] if r and r[0] is not None else None
-    rows = []
-    for i, t in enumerate(times):
-        if max_ts is not None and t <= max_ts:
-            continue
-        # Obsługa brakujących danych analogicznie do hourly
-        def last_or(value, col_name):
-            if value is not None:
-                return value
-            cur2 = conn.cursor()
-            try:
-                cur2.execute(f"SELECT {col_name} FROM minutely15 WHERE location_id=? ORDER BY timestamp DESC LIMIT 1", (location_id,))
-                row2 = cur2.fetchone()
-                return row2[0] if row2 else None
-            finally:
-                cur2.close()
-
-        t_temp = last_or(temps[i] if i < len(temps) else None, "temperature")
-        t_wind = last_or(wind[i] if i < len(wind) else None, "wind_speed")
-        t_rain = last_or(rains[i] if i < len(rains) else None, "rain")
-        t_snow = last_or(snows[i] if i < len(snows) else None, "snowfall")
-        t_dir = dirs[i] if i < len(dirs) else None
-        t_code = codes[i] if i < len(codes) else None
-
-        rows.append((location_id, t, t_temp, t_wind, t_rain, t_snow, t_dir, t_code))
-        # Alerty analogiczne do hourly
+    cur.execute(_SQL_LAST_MINUTELY, (location_id,))
+    max_ts, last_temp, last_wind, last_rain, last_snow = cur.fetchone() or (None, None, None, None, None)
+    idx = _new_rows(times, max_ts)
+    if not idx:
+        return 0
+    r_times = _column(times, idx)
+    # Obsługa brakujących danych analogicznie do hourly
+    r_temps = _ffill(temps, idx, last_temp)
+    r_winds = _ffill(wind, idx, last_wind)
+    r_rains = _ffill(rains, idx, last_rain)
+    r_snows = _ffill(snows, idx, last_snow)
+    r_codes = _column(codes, idx)
+    rows = zip(repeat(location_id), r_times, r_temps, r_winds, r_rains, r_snows,
+               _column(dirs, idx), r_codes)
+    cur.executemany(_SQL_INSERT_MINUTELY if max_ts is not None else _SQL_INSERT_MINUTELY_FIRST, rows)
+    # Alerty analogiczne do hourly
+    detected = _detect_alerts(location_id, r_times, r_temps, r_winds, r_rains, r_snows, r_codes, now or datetime.utcnow())
+    if alerts is not None:
+        alerts.extend(detected)
+    else:
+        insert_alerts(conn, detected)
+    return len(r_times)
+
+
+# Surowe payloady zapisuje na dysk osobny wątek - pętla pobierania/zapisu do bazy
+# nie czeka na kompresję i zapis pliku. Kolejka jest ograniczona, żeby przy wolnym
+# dysku nie trzymać w pamięci wielu payloadów naraz.
+_raw_q: "queue.Queue[tuple[dict, str, str]]" = queue.Queue(maxsize=32)
+_raw_thread: threading.Thread | None = None
+_raw_lock = threading.Lock()
+
+
+def _raw_writer() -> None:
+    while True:
+        payload, fname, prefix = _raw_q.get()
         try:
-            if t_wind is not None and float(t_wind) > ALERT_WIND_THRESHOLD:
-                insert_alert(conn, location_id, t, "wind_speed", float(t_wind), f"Wiatr przekroczył {ALERT_WIND_THRESHOLD} m/s")
-            if t_temp is not None:
-                try:
-                    if float(t_temp) <= ALERT_TEMP_LOW_THRESHOLD:
-                        insert_alert(conn, location_id, t, "temperature", float(t_temp), f"Temperatura poniżej {ALERT_TEMP_LOW_THRESHOLD} °C")
-                except Exception:
-                    logger.exception("Błąd przy sprawdzaniu progu temperatury (minutely)")
-            try:
-                precip = False
-                if t_rain is not None and float(t_rain) > 0:
-                    precip = True
-                if t_snow is not None and float(t_snow) > 0:
-                    precip = True
-                if t_code is not None:
-                    try:
-                        if int(t_code) in ALERT_WEATHER_CODES_PRECIP:
-                            precip = True
-                    except Exception:
-                        pass
-                if precip:
-                    insert_alert(conn, location_id, t, "precipitation", float(t_rain or t_snow or 0.0), "Wykryto możliwe opady")
-            except Exception:
-                logger.exception("Błąd przy sprawdzaniu opadów (minutely)")
+            save_payload_to_json(payload, filename=fname, prefix=prefix, compress=True)
+            logger.info("Zapisano payload do %s", fname)
+        except Exception:
+            logger.exception("Nie udało się zapisać payloadu do JSON")
+        finally:
+            _raw_q.task_done()
+
+
+def flush_raw_payloads(timeout: float = 30.0) -> None:
+    """Poczekaj (najwyżej `timeout` sekund) aż zakolejkowane payloady trafią na dysk."""
+    deadline = time.monotonic() + timeout
+    while _raw_q.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def _queue_raw_payload(loc: dict, payload: dict, now: datetime | None = None) -> None:
+    global _raw_thread
+    with _raw_lock:
+        if _raw_thread is None:
+            _raw_thread = threading.Thread(target=_raw_writer, name="raw-payload-writer", daemon=True)
+            _raw_thread.start()
+            atexit.register(flush_raw_payloads)
+    ts = (now or datetime.utcnow()).strftime("%Y%m%dT%H%M%SZ")
+    safe_name = loc.get("name", "unknown").replace(" ", "_")
+    _raw_q.put((payload, f"{safe_name}-{ts}.json.gz", safe_name))
+
+
+def _store_location(conn: sqlite3.Connection, loc: dict, loc_id: int, payload: dict,
+                    fetch_hourly: bool, fetch_minutely: bool, now: datetime) -> int:
+    """Przeanalizuj i zapisz payload jednej lokalizacji w jednej krótkiej transakcji.
+
+    Blokada zapisu trwa tylko przez zapis tej lokalizacji, nie przez pobieranie
+    pozostałych. Przy błędzie transakcja jest wycofywana, żeby połączenie
+    (autocommit, współdzielone między cyklami) nie zostało w otwartej transakcji.
+    Zwraca liczbę zapisanych wierszy.
+    """
+    total = 0
+    # IMMEDIATE bierze blokadę zapisu od razu, więc odczyty przed pierwszym INSERT
+    # nie kończą się SQLITE_BUSY przy podnoszeniu blokady
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Analiza payloadu pod kątem alertów (np. nadchodzące/obecne warunki)
+        try:
+            alerts_added = Alert.analyze_payload_and_alert(conn, loc_id, payload, now)
+            if alerts_added:
+                logger.info("Wygenerowano %d alertów z analizy payloadu dla %s", alerts_added, loc.get("name"))
         except Exception:
-            logger.exception("Błąd przy sprawdzaniu alertów (minutely)")
-    if rows:
-        cur.executemany("INSERT OR REPLACE INTO minutely15 (location_id, timestamp, temperature, wind_speed, rain, snowfall, wind_direction, weather_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            logger.exception("Błąd przy analizie payloadu pod kątem alertów")
+        # alerty z zapisu hourly i minutely_15 wstawiamy jednym executemany
+        pending_alerts: list[tuple] = []
+        if fetch_hourly:
+            total += store_hourly(conn, loc_id, payload, pending_alerts, now)
+        if fetch_minutely:
+            total += store_minutely15(conn, loc_id, payload, pending_alerts, now)
+        insert_alerts(conn, pending_alerts)
         conn.commit()
-    return len(rows)
+    except BaseException:
+        conn.rollback()
+        Alert.drop_pending_alerts(conn)
+        raise
+    Alert.publish_pending_alerts(conn)
+    return total
 
 
 def fetch_and_store_all(db_path: Path, *, fetch_hourly: bool = True, fetch_minutely: bool = True, location_names: list[str] | None = None, save_payloads: bool = False) -> int:
@@ -384,38 +782,54 @@ def fetch_and_store_all(db_path: Path, *, fetch_hourly: bool = True, fetch_minut
         raise ValueError("Przynajmniej jedna z opcji fetch_hourly lub fetch_minutely musi być True")
 
     ensure_dirs()
-    conn = sqlite3.connect(db_path)
-    init_db(conn)
+    conn = _get_conn(db_path)
+    session = _http_session(db_path)
+    loc_ids = _location_ids[str(db_path)]
     total = 0
-    for loc in LOCATIONS:
-        if location_names is not None and loc.get("name") not in location_names:
-            continue
-        loc_id = insert_or_get_location(conn, loc)
-        payload = fetch_location(loc)
-        # Analiza payloadu pod kątem alertów (np. nadchodzące/obecne warunki)
-        try:
-            alerts_added = Alert.analyze_payload_and_alert(conn, loc_id, payload)
-            if alerts_added:
-                logger.info("Wygenerowano %d alertów z analizy payloadu dla %s", alerts_added, loc.get("name"))
-        except Exception:
-            logger.exception("Błąd przy analizie payloadu pod kątem alertów")
-
-        # opcjonalnie zapisz surowy payload do pliku JSON na dysku
-        if save_payloads:
+    selected = [loc for loc in LOCATIONS if location_names is None or loc.get("name") in location_names]
+    if not selected:
+        return 0
+    # jedna chwila odniesienia (UTC) dla całego cyklu - alerty, origin, nazwy plików
+    now = datetime.utcnow()
+    fetch_error: Exception | None = None
+    # pobieranie jest ograniczone siecią - wszystkie lokalizacje pobieramy równolegle;
+    # zapis do SQLite zostaje w tym wątku (jeden pisarz): każdą lokalizację zapisujemy
+    # zaraz po jej pobraniu, więc zapis nakłada się na pobieranie pozostałych
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(selected))) as pool:
+        futures = {
+            pool.submit(_fetch_location, loc, session, _http_validators.get((str(db_path), loc["name"], fetch_hourly, fetch_minutely))): loc
+            for loc in selected
+        }
+        for future in as_completed(futures):
+            loc = futures[future]
             try:
-                ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-                safe_name = loc.get("name", "unknown").replace(" ", "_")
-                fname = f"{safe_name}-{ts}.json"
-                save_payload_to_json(payload, filename=fname, prefix=safe_name)
-                logger.info("Zapisano payload do %s", fname)
-            except Exception:
-                logger.exception("Nie udało się zapisać payloadu do JSON")
-
-        if fetch_hourly:
-            total += store_hourly(conn, loc_id, payload)
-        if fetch_minutely:
-            total += store_minutely15(conn, loc_id, payload)
-    conn.close()
+                payload, validators = future.result()
+            except Exception as e:
+                # błąd jednej lokalizacji nie przekreśla pozostałych - zapisujemy je,
+                # a wyjątek zgłaszamy na końcu cyklu
+                if fetch_error is None:
+                    fetch_error = e
+                continue
+            if payload is None:
+                # 304 - dane bez zmian, nie ma czego analizować ani zapisywać
+                continue
+            loc_id = loc_ids.get(loc["name"])
+            if loc_id is None:
+                loc_id = loc_ids[loc["name"]] = insert_or_get_location(conn, loc)
+            # opcjonalnie zapisz surowy payload do pliku JSON na dysku (w tle)
+            if save_payloads:
+                _queue_raw_payload(loc, payload, now)
+            total += _store_location(conn, loc, loc_id, payload, fetch_hourly, fetch_minutely, now)
+            # walidatory zapamiętujemy dopiero po commicie; inaczej dane, które nie trafiły
+            # do bazy, przy kolejnym cyklu dostałyby 304 i nie zostałyby zapisane aż do
+            # zmiany danych w API
+            if validators is not None:
+                _http_validators[(str(db_path), loc["name"], fetch_hourly, fetch_minutely)] = validators
+    # checkpoint WAL teraz, przed przerwą do następnego cyklu - przenosi strony do pliku
+    # bazy i skraca WAL do zera, więc autocheckpoint nie zatrzyma commita kolejnego zapisu
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    if fetch_error is not None:
+        raise fetch_error
     return total
 
 
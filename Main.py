@@ -1,5 +1,7 @@
 from pathlib import Path
 import logging
+import os
+import selectors
 import threading
 import time
 import sys
@@ -19,6 +21,50 @@ def _yes(ans: str) -> bool:
     return ans.strip().lower() in {"y", "t", "tak"}
 
 
+def _parse_command(line: str) -> tuple[bool, int | None]:
+    """Zinterpretuj polecenie z konsoli: zwraca (czy zakończyć, nowy interwał w sekundach lub None)."""
+    cmd = line.strip().lower()
+    if cmd in {"q", "quit"}:
+        return True, None
+    if cmd.startswith("freq"):
+        parts = cmd.split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            newm = int(parts[1])
+            print(f"Nowa częstotliwość: {newm} minut")
+            return False, max(1, newm * 60)
+    return False, None
+
+
+def _stdin_selector() -> selectors.BaseSelector | None:
+    """Selektor na stdin; None gdy platforma go nie obsługuje (Windows: select tylko dla gniazd).
+
+    Tylko dla terminala: z potoku/pliku `input()` wczytuje do bufora `sys.stdin` więcej niż
+    jedną linię, więc polecenia podane z góry nie dotarłyby już do deskryptora.
+    """
+    if sys.platform == "win32" or not sys.stdin.isatty():
+        return None
+    try:
+        sel = selectors.DefaultSelector()
+        sel.register(sys.stdin, selectors.EVENT_READ)
+        return sel
+    except (ValueError, OSError):
+        return None
+
+
+def _read_commands(fd: int, pending: bytes, encoding: str) -> tuple[list[str], bytes, bool]:
+    """Jeden `os.read` z `fd` podzielony na pełne linie.
+
+    Zwraca (linie, niepełna końcówka do następnego odczytu, czy koniec wejścia).
+    Czytamy z deskryptora z pominięciem bufora `sys.stdin` - inaczej linie wklejone
+    naraz zostałyby w buforze Pythona, a selektor nie zgłosiłby ich ponownie.
+    """
+    chunk = os.read(fd, 4096)
+    if not chunk:
+        return ([pending.decode(encoding, errors="replace")] if pending else []), b"", True
+    *lines, rest = (pending + chunk).split(b"\n")
+    return [line.decode(encoding, errors="replace") for line in lines], rest, False
+
+
 def main():
     login_logger = setup_logger()
     _attach_handlers("login", "meteofetch")
@@ -51,6 +97,7 @@ def main():
         ans_cont = input("Uruchomić w trybie ciągłym? [y/N] ").strip().lower()
         #ans_save = input("Czy zapisać surowe odpowiedzi API do plików JSON na dysku? [y/N] ").strip().lower()
         #save_payloads = _yes(ans_save)
+        save_payloads = False
 
         if _yes(ans_cont):
             minutes = input("Podaj częstotliwość w minutach (np. 60): ").strip()
@@ -60,30 +107,42 @@ def main():
                 interval = 3600
 
             stop_event = threading.Event()
-
-            def control_thread():
-                print("Tryb ciągły uruchomiony. Wpisz 'freq <min>' aby zmienić częstotliwość lub 'q' aby zakończyć.")
-                while not stop_event.is_set():
-                    line = sys.stdin.readline()
-                    if not line:
-                        continue
-                    cmd = line.strip().lower()
-                    if cmd in {"q", "quit"}:
-                        stop_event.set()
-                        break
-                    if cmd.startswith("freq"):
-                        parts = cmd.split()
-                        if len(parts) >= 2 and parts[1].isdigit():
-                            newm = int(parts[1])
-                            nonlocal interval
-                            interval = max(1, newm * 60)
-                            print(f"Nowa częstotliwość: {newm} minut")
-
-            threading.Thread(target=control_thread, daemon=True).start()
+            print("Tryb ciągły uruchomiony. Wpisz 'freq <min>' aby zmienić częstotliwość lub 'q' aby zakończyć.")
+            # polecenia z konsoli odbieramy w tej samej pętli co oczekiwanie na kolejną iterację
+            # (selektor na stdin); osobny wątek tylko tam, gdzie selektor nie działa
+            sel = _stdin_selector()
+
+            if sel is None:
+                # budzi oczekiwanie pętli po 'freq'/'q', żeby nowy interwał objął bieżące czekanie
+                wake = threading.Event()
+
+                def control_thread():
+                    nonlocal interval
+                    while not stop_event.is_set():
+                        line = sys.stdin.readline()
+                        if not line:
+                            break
+                        quit_cmd, new_interval = _parse_command(line)
+                        if quit_cmd:
+                            stop_event.set()
+                            wake.set()
+                            break
+                        if new_interval is not None:
+                            interval = new_interval
+                            wake.set()
+
+                threading.Thread(target=control_thread, daemon=True).start()
+            else:
+                stdin_fd = sys.stdin.fileno()
+                stdin_encoding = sys.stdin.encoding or "utf-8"
+                pending = b""
 
             try:
                 while not stop_event.is_set():
-                    start = time.time()
+                    # zegar monotoniczny: korekta czasu systemowego (NTP, zmiana czasu)
+                    # nie skraca ani nie wydłuża oczekiwania; czekamy interval minus czas
+                    # pobierania, więc długość fetchu nie przesuwa kolejnych iteracji
+                    start = time.monotonic()
                     inserted_alerts = fetch_and_store_all(
                         Path(DB_PATH),
                         fetch_hourly=fetch_hourly,
@@ -92,8 +151,34 @@ def main():
                         save_payloads=save_payloads
                     )
                     bot_logger.info("Iteracja zakończona. Wstawiono alertów: %d", inserted_alerts)
-                    wait_seconds = max(0, interval - (time.time() - start))
-                    stop_event.wait(timeout=wait_seconds)
+                    # czekamy do start + interval; zmiana częstotliwości skraca/wydłuża bieżące oczekiwanie
+                    if sel is None:
+                        while not stop_event.is_set():
+                            remaining = interval - (time.monotonic() - start)
+                            if remaining <= 0:
+                                break
+                            wake.wait(timeout=remaining)
+                            wake.clear()
+                        continue
+                    while not stop_event.is_set():
+                        remaining = interval - (time.monotonic() - start)
+                        if remaining <= 0:
+                            break
+                        if not sel.select(timeout=remaining):
+                            continue
+                        lines, pending, eof = _read_commands(stdin_fd, pending, stdin_encoding)
+                        for line in lines:
+                            quit_cmd, new_interval = _parse_command(line)
+                            if quit_cmd:
+                                stop_event.set()
+                                break
+                            if new_interval is not None:
+                                interval = new_interval
+                        if eof:
+                            # koniec stdin - dalej tylko czekamy na kolejne iteracje
+                            sel.unregister(sys.stdin)
+                            stop_event.wait(timeout=max(0, interval - (time.monotonic() - start)))
+                            break
             except Exception as e:
                 log_exception(login_logger, e, context="main.continuous_loop")
                 bot_logger.error("Błąd w trybie ciągłym. Sprawdź logi.")
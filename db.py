@@ -1,8 +1,35 @@
+import atexit
 import json
 import os
 import sqlite3
-from typing import Dict, Iterable, List, Optional
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import chain, repeat
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union
 
+try:
+    # szybsza serializacja JSON (opcjonalna); bez niej używamy modułu json
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Klucze naturalne: jeden wiersz na (lokalizacja, godzina) / (lokalizacja, dzień) - ponowne
+# pobranie aktualizuje wiersze zamiast dopisywać duplikaty. Nazwa indeksu -> (tabela, kolumny).
+_UNIQUE_INDEXES = {
+    "ux_hourly_loc_time": ("hourly", "location_id, timestamp"),
+    "ux_daily_loc_date": ("daily", "location_id, date"),
+}
+# Dawne nie-unikalne indeksy na tych samych kolumnach - zastąpione przez _UNIQUE_INDEXES
+_LEGACY_INDEXES = ("idx_hourly_loc_time", "idx_daily_loc_date")
+
+# Nowe bazy: `hourly.timestamp` jako INTEGER (sekundy epoki Unix, UTC) zamiast tekstu
+# ISO - ok. 5 bajtów zamiast 16 w każdym wierszu i w indeksie; tabela STRICT (SQLite
+# >= 3.37) pilnuje typów. Starsze bazy z timestamp TEXT działają dalej bez konwersji.
+_STRICT = " STRICT" if sqlite3.sqlite_version_info >= (3, 37, 0) else ""
 
 DB_SCHEMA_SQL = [
     """
@@ -24,11 +51,11 @@ DB_SCHEMA_SQL = [
         timezone TEXT
     )
     """,
-    """
+    f"""
     CREATE TABLE IF NOT EXISTS hourly (
         id INTEGER PRIMARY KEY,
         location_id INTEGER,
-        timestamp TEXT,
+        timestamp INTEGER,
         temperature_2m REAL,
         rain REAL,
         showers REAL,
@@ -42,7 +69,7 @@ DB_SCHEMA_SQL = [
         wind_speed_120m REAL,
         wind_speed_180m REAL,
         FOREIGN KEY(location_id) REFERENCES locations(id)
-    )
+    ){_STRICT}
     """,
     """
     CREATE TABLE IF NOT EXISTS daily (
@@ -58,23 +85,163 @@ DB_SCHEMA_SQL = [
         FOREIGN KEY(location_id) REFERENCES locations(id)
     )
     """,
-    "CREATE INDEX IF NOT EXISTS idx_hourly_loc_time ON hourly(location_id, timestamp)",
-    "CREATE INDEX IF NOT EXISTS idx_daily_loc_date ON daily(location_id, date)",
 ]
 
 
+# Teksty INSERT jako stałe - ten sam tekst trafia w cache przygotowanych zapytań połączenia
+_HOURLY_SQL = (
+    "INSERT INTO hourly (location_id, timestamp, temperature_2m, rain, showers, snowfall, snow_depth, precipitation_probability, visibility, relative_humidity_2m, wind_speed_10m, wind_speed_80m, wind_speed_120m, wind_speed_180m) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(location_id, timestamp) DO UPDATE SET temperature_2m=excluded.temperature_2m, rain=excluded.rain, showers=excluded.showers, snowfall=excluded.snowfall, snow_depth=excluded.snow_depth, precipitation_probability=excluded.precipitation_probability, visibility=excluded.visibility, relative_humidity_2m=excluded.relative_humidity_2m, wind_speed_10m=excluded.wind_speed_10m, wind_speed_80m=excluded.wind_speed_80m, wind_speed_120m=excluded.wind_speed_120m, wind_speed_180m=excluded.wind_speed_180m"
+)
+_DAILY_SQL = (
+    "INSERT INTO daily (location_id, date, temperature_2m_max, temperature_2m_min, sunrise, sunset, uv_index_max, precipitation_hours) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(location_id, date) DO UPDATE SET temperature_2m_max=excluded.temperature_2m_max, temperature_2m_min=excluded.temperature_2m_min, sunrise=excluded.sunrise, sunset=excluded.sunset, uv_index_max=excluded.uv_index_max, precipitation_hours=excluded.precipitation_hours"
+)
+_FETCH_META_SQL = "INSERT INTO fetches (fetched_at, source, fetch_type, params, note) VALUES (?, ?, ?, ?, ?)"
+
+# Ustawienia połączenia: WAL (jeden fsync na commit, czytelnicy nie blokują pisarza),
+# większy cache stron i mmap
+DB_PRAGMA_SQL = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+]
+
+
+# Ścieżki baz, dla których schemat został już utworzony w tym procesie
+_INITIALIZED: set = set()
+
+
+def _create_schema(conn: sqlite3.Connection, path: str) -> None:
+    if path in _INITIALIZED:
+        return
+    # wszystkie CREATE w jednej transakcji - jeden commit zamiast jednego na instrukcję
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for s in DB_SCHEMA_SQL:
+            cur.execute(s)
+        existing = {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        for name, (table, cols) in _UNIQUE_INDEXES.items():
+            if name in existing:
+                continue
+            # migracja starszej bazy: usuń duplikaty (zostaje najnowszy wiersz), potem indeks UNIQUE
+            cur.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {cols})")
+            cur.execute(f"CREATE UNIQUE INDEX {name} ON {table}({cols})")
+        for name in _LEGACY_INDEXES:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    _INITIALIZED.add(path)
+
+
 def init_db(path: str) -> None:
     """Utwórz strukturę bazy danych na dysku jeśli nie istnieje.
 
     Tworzy plik bazy (katalog jeśli potrzeba) i wykonuje schemat z DB_SCHEMA_SQL.
+    Wystarczy wywołać raz przy starcie; funkcje zapisujące same z niej nie korzystają.
     """
-    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    conn = sqlite3.connect(path)
-    cur = conn.cursor()
-    for s in DB_SCHEMA_SQL:
-        cur.execute(s)
-    conn.commit()
-    conn.close()
+    get_conn(path)
+
+
+# Połączenia współdzielone per plik bazy - schemat tworzymy raz, przy pierwszym otwarciu
+_conn_cache: Dict[str, sqlite3.Connection] = {}
+_conn_lock = threading.Lock()
+
+
+def get_conn(path: str) -> sqlite3.Connection:
+    """Zwróć połączenie do bazy `path` (otwierane raz i ponownie używane).
+
+    Połączenie działa w trybie autocommit (`isolation_level=None`) - transakcje
+    otwierają jawnie funkcje zapisujące.
+    """
+    conn = _conn_cache.get(path)
+    if conn is not None:
+        return conn
+    with _conn_lock:
+        conn = _conn_cache.get(path)
+        if conn is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=256)
+            for s in DB_PRAGMA_SQL:
+                conn.execute(s)
+            _create_schema(conn, path)
+            _conn_cache[path] = conn
+    return conn
+
+
+@atexit.register
+def _close_conns() -> None:
+    """Zamknij współdzielone połączenia przy wyjściu z procesu."""
+    with _conn_lock:
+        for conn in _conn_cache.values():
+            conn.close()
+        _conn_cache.clear()
+        _loc_cache.clear()
+        _loc_pending.clear()
+        _epoch_conns.clear()
+        _tx_locks.clear()
+
+
+# Blokada transakcji per połączenie. Połączenie jest współdzielone między wątkami
+# (`check_same_thread=False`), a transakcja należy do połączenia, nie do wątku - bez
+# blokady drugi wątek dołączyłby do cudzej transakcji (i jej ROLLBACK cofnąłby jego zapisy).
+# RLock: zagnieżdżona `transaction` w tym samym wątku nadal dołącza do zewnętrznej.
+_tx_locks: Dict[sqlite3.Connection, threading.RLock] = {}
+
+
+def _tx_lock(conn: sqlite3.Connection) -> threading.RLock:
+    lock = _tx_locks.get(conn)
+    if lock is None:
+        with _conn_lock:
+            lock = _tx_locks.setdefault(conn, threading.RLock())
+    return lock
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Jedna transakcja dla kilku zapisów (np. hourly + daily + metadane jednego pobrania).
+
+    Funkcje zapisujące wywołane wewnątrz nie otwierają własnych transakcji.
+    Zagnieżdżone wywołanie dołącza do transakcji zewnętrznej. BEGIN IMMEDIATE
+    bierze blokadę zapisu od razu, więc przy równoległym czytelniku nie ma
+    "database is locked" w połowie transakcji (przy WAL czytelnicy nie blokują).
+    Inne wątki używające tego samego połączenia czekają na koniec całego bloku.
+    """
+    with _tx_lock(conn):
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            _drop_pending_locations(conn)
+            raise
+        conn.execute("COMMIT")
+        with _conn_lock:
+            _loc_pending.pop(conn, None)
+
+
+# id lokalizacji per baza: (latitude, longitude) -> id; wczytywane raz z tabeli locations
+_loc_cache: Dict[str, Dict[tuple, int]] = {}
+# lokalizacje dodane w trwającej transakcji połączenia: (baza, współrzędne) - po
+# ROLLBACK wiersza już nie ma, więc usuwamy je z `_loc_cache`
+_loc_pending: Dict[sqlite3.Connection, list] = {}
+
+
+def _drop_pending_locations(conn: sqlite3.Connection) -> None:
+    with _conn_lock:
+        for path, key in _loc_pending.pop(conn, ()):
+            ids = _loc_cache.get(path)
+            if ids is not None:
+                ids.pop(key, None)
 
 
 def insert_location(path: str, latitude: float, longitude: float, elevation: Optional[float] = None, timezone: Optional[str] = None) -> int:
@@ -86,92 +253,149 @@ def insert_location(path: str, latitude: float, longitude: float, elevation: Opt
       - elevation, timezone: opcjonalne metadane
     Zwraca: id lokalizacji (int)
     """
-    init_db(path)
-    conn = sqlite3.connect(path)
-    cur = conn.cursor()
-    # try to find existing
-    cur.execute("SELECT id FROM locations WHERE latitude=? AND longitude=?", (latitude, longitude))
-    row = cur.fetchone()
-    if row:
-        loc_id = row[0]
-    else:
-        cur.execute("INSERT INTO locations (latitude, longitude, elevation, timezone) VALUES (?, ?, ?, ?)", (latitude, longitude, elevation, timezone))
-        loc_id = cur.lastrowid
-        conn.commit()
-    conn.close()
+    conn = get_conn(path)
+    with _conn_lock:
+        ids = _loc_cache.get(path)
+        loc_id = ids.get((latitude, longitude)) if ids is not None else None
+    if loc_id is not None:
+        return loc_id
+    # INSERT poza transakcją innego wątku (autocommit) albo wewnątrz własnej
+    with _tx_lock(conn), _conn_lock:
+        ids = _loc_cache.get(path)
+        if ids is None:
+            ids = _loc_cache[path] = {
+                (lat, lon): loc_id for loc_id, lat, lon in conn.execute("SELECT id, latitude, longitude FROM locations")
+            }
+        loc_id = ids.get((latitude, longitude))
+        if loc_id is None:
+            cur = conn.execute("INSERT INTO locations (latitude, longitude, elevation, timezone) VALUES (?, ?, ?, ?)", (latitude, longitude, elevation, timezone))
+            loc_id = ids[(latitude, longitude)] = cur.lastrowid
+            if conn.in_transaction:
+                # wiersz jest trwały dopiero po COMMIT - `transaction` wycofa wpis przy ROLLBACK
+                _loc_pending.setdefault(conn, []).append((path, (latitude, longitude)))
     return loc_id
 
 
-def insert_hourly_bulk(path: str, location_id: int, rows: Iterable[Dict]) -> None:
-    """Rows is iterable of dicts with keys matching hourly columns (timestamp, temperature_2m, ...)."""
-    # Przygotuj i wstaw wiele wierszy do tabeli `hourly`.
-    init_db(path)
-    conn = sqlite3.connect(path)
-    cur = conn.cursor()
-    to_insert: List[tuple] = []
-    for r in rows:
-        to_insert.append(
-            (
-                location_id,
-                r.get("timestamp"),
-                r.get("temperature_2m"),
-                r.get("rain"),
-                r.get("showers"),
-                r.get("snowfall"),
-                r.get("snow_depth"),
-                r.get("precipitation_probability"),
-                r.get("visibility"),
-                r.get("relative_humidity_2m"),
-                r.get("wind_speed_10m"),
-                r.get("wind_speed_80m"),
-                r.get("wind_speed_120m"),
-                r.get("wind_speed_180m"),
-            )
-        )
-    cur.executemany(
-        "INSERT INTO hourly (location_id, timestamp, temperature_2m, rain, showers, snowfall, snow_depth, precipitation_probability, visibility, relative_humidity_2m, wind_speed_10m, wind_speed_80m, wind_speed_120m, wind_speed_180m) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        to_insert,
-    )
-    conn.commit()
-    conn.close()
+# Kolejność kluczy odpowiada kolumnom w _HOURLY_SQL / _DAILY_SQL (po location_id)
+_HOURLY_KEYS = (
+    "timestamp",
+    "temperature_2m",
+    "rain",
+    "showers",
+    "snowfall",
+    "snow_depth",
+    "precipitation_probability",
+    "visibility",
+    "relative_humidity_2m",
+    "wind_speed_10m",
+    "wind_speed_80m",
+    "wind_speed_120m",
+    "wind_speed_180m",
+)
+_DAILY_KEYS = (
+    "date",
+    "temperature_2m_max",
+    "temperature_2m_min",
+    "sunrise",
+    "sunset",
+    "uv_index_max",
+    "precipitation_hours",
+)
+_hourly_values = itemgetter(*_HOURLY_KEYS)
+_daily_values = itemgetter(*_DAILY_KEYS)
 
 
-def insert_daily_bulk(path: str, location_id: int, rows: Iterable[Dict]) -> None:
-    # Wstaw wiele wierszy do tabeli `daily` (zbiorcze wartości dzienne).
-    init_db(path)
-    conn = sqlite3.connect(path)
-    cur = conn.cursor()
-    to_insert: List[tuple] = []
+def _row_tuples(location_id: int, rows: Iterable[Dict], keys: tuple, values: Callable[[Dict], tuple]) -> Iterator[tuple]:
+    """Generuj krotki do `executemany` bez budowania listy wszystkich wierszy.
+
+    Wiersz może być krotką w kolejności `keys` - wtedy trafia do SQL bez zmian.
+    Dla słownika `values` (itemgetter) wyciąga wszystkie kolumny naraz; wiersz
+    bez któregoś klucza obsługujemy wolniej, przez `dict.get` (brak -> None).
+    """
     for r in rows:
-        to_insert.append(
-            (
-                location_id,
-                r.get("date"),
-                r.get("temperature_2m_max"),
-                r.get("temperature_2m_min"),
-                r.get("sunrise"),
-                r.get("sunset"),
-                r.get("uv_index_max"),
-                r.get("precipitation_hours"),
-            )
-        )
-    cur.executemany(
-        "INSERT INTO daily (location_id, date, temperature_2m_max, temperature_2m_min, sunrise, sunset, uv_index_max, precipitation_hours) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        to_insert,
-    )
-    conn.commit()
-    conn.close()
+        if type(r) is tuple:
+            yield (location_id, *r)
+            continue
+        try:
+            yield (location_id, *values(r))
+        except KeyError:
+            yield (location_id, *[r.get(k) for k in keys])
+
+
+@lru_cache(maxsize=8192)
+def _iso_to_epoch(ts: str) -> int:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        # Open-Meteo zwraca czasy w UTC (timezone=UTC) bez sufiksu strefy
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _to_epoch(ts):
+    return _iso_to_epoch(ts) if isinstance(ts, str) else ts
 
 
-def save_fetch_meta(path: str, fetched_at: str, source: str, fetch_type: str, params: Optional[Dict] = None, note: Optional[str] = None) -> None:
+# czy `hourly.timestamp` w bazie danego połączenia jest INTEGER (nowy schemat)
+_epoch_conns: Dict[sqlite3.Connection, bool] = {}
+
+
+def _hourly_epoch(conn: sqlite3.Connection) -> bool:
+    epoch = _epoch_conns.get(conn)
+    if epoch is None:
+        types = {r[1]: r[2].upper() for r in conn.execute("PRAGMA table_info(hourly)")}
+        epoch = _epoch_conns[conn] = types.get("timestamp") == "INTEGER"
+    return epoch
+
+
+def insert_hourly_bulk(conn: sqlite3.Connection, location_id: int, rows: Iterable[Union[Dict, tuple]]) -> None:
+    """Rows is iterable of dicts with keys matching hourly columns (timestamp, temperature_2m, ...)
+    or of tuples with values in `_HOURLY_KEYS` order (cheaper - no per-row dict).
+
+    Timestamp może być tekstem ISO ("2024-01-01T00:00", UTC) - w nowym schemacie
+    zapisywany jest jako sekundy epoki Unix.
+    """
+    # Przygotuj i wstaw wiele wierszy do tabeli `hourly` w jednej transakcji.
+    tuples = _row_tuples(location_id, rows, _HOURLY_KEYS, _hourly_values)
+    if _hourly_epoch(conn):
+        tuples = ((t[0], _to_epoch(t[1]), *t[2:]) for t in tuples)
+    with transaction(conn):
+        conn.executemany(_HOURLY_SQL, tuples)
+
+
+def insert_hourly_columnar(conn: sqlite3.Connection, location_id: int, hourly: Dict) -> int:
+    """Wstaw blok `hourly` w formie z API (kolumny: "time", "temperature_2m", ...).
+
+    Wiersze składa `zip` po kolumnach - bez pośrednich słowników per wiersz.
+    Brakujące lub krótsze kolumny uzupełniane są None. Zwraca liczbę wierszy.
+    """
+    times = hourly.get("time") or []
+    cols = [chain(hourly.get(k) or (), repeat(None)) for k in _HOURLY_KEYS[1:]]
+    ts_col = map(_to_epoch, times) if _hourly_epoch(conn) else times
+    with transaction(conn):
+        conn.executemany(_HOURLY_SQL, zip(repeat(location_id), ts_col, *cols))
+    return len(times)
+
+
+def insert_daily_bulk(conn: sqlite3.Connection, location_id: int, rows: Iterable[Union[Dict, tuple]]) -> None:
+    # Wstaw wiele wierszy do tabeli `daily` (zbiorcze wartości dzienne) w jednej transakcji;
+    # wiersz to słownik albo krotka w kolejności `_DAILY_KEYS`.
+    with transaction(conn):
+        conn.executemany(_DAILY_SQL, _row_tuples(location_id, rows, _DAILY_KEYS, _daily_values))
+
+
+def save_fetch_meta(path: Union[str, sqlite3.Connection], fetched_at: str, source: str, fetch_type: str, params: Optional[Dict] = None, note: Optional[str] = None) -> None:
     """Zapisz metadane o wykonanym pobraniu (np. czas, źródło, parametry).
 
-    Przydatne do audytu i śledzenia historii fetchów.
+    Przydatne do audytu i śledzenia historii fetchów. Zamiast ścieżki można
+    podać otwarte połączenie - wtedy zapis dołącza do trwającej `transaction`.
     """
-    init_db(path)
-    conn = sqlite3.connect(path)
+    conn = path if isinstance(path, sqlite3.Connection) else get_conn(path)
     cur = conn.cursor()
-    params_json = json.dumps(params, ensure_ascii=False) if params is not None else None
-    cur.execute("INSERT INTO fetches (fetched_at, source, fetch_type, params, note) VALUES (?, ?, ?, ?, ?)", (fetched_at, source, fetch_type, params_json, note))
-    conn.commit()
-    conn.close()
+    if params is None:
+        params_json = None
+    elif orjson is not None:
+        params_json = orjson.dumps(params, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    else:
+        params_json = json.dumps(params, ensure_ascii=False)
+    with _tx_lock(conn):
+        cur.execute(_FETCH_META_SQL, (fetched_at, source, fetch_type, params_json, note))
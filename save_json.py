@@ -7,26 +7,37 @@ Zawiera funkcje do:
 Komentarze i komunikaty w języku polskim.
 """
 from pathlib import Path
+import atexit
+import gzip
 import json
-from datetime import datetime
 import sqlite3
+import time
 from typing import Any, Iterable
 
+try:
+	# szybsza serializacja JSON (opcjonalna); bez niej używamy modułu json
+	import orjson
+except ImportError:
+	orjson = None
+
 
 DATA_DIR = Path("data")
+# liczba wierszy pobieranych naraz przy eksporcie tabeli
+EXPORT_BATCH = 10_000
 
 
 def ensure_data_dir() -> None:
 	DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def save_payload_to_json(payload: Any, filename: str | None = None, prefix: str = "payload") -> Path:
+def save_payload_to_json(payload: Any, filename: str | None = None, prefix: str = "payload", compress: bool = False) -> Path:
 	"""Zapisz `payload` (np. słownik z API) do pliku JSON.
 
 	Parametry:
 	  - payload: obiekt serializowalny do JSON (dict/list)
 	  - filename: jeśli podany, użyty jako nazwa pliku (bez katalogu)
 	  - prefix: używany gdy `filename` jest None (domyślnie 'payload')
+	  - compress: zapisz zwarty JSON (bez wcięć) skompresowany gzip (poziom 1, `.json.gz`)
 
 	Zwraca: Path do zapisanego pliku.
 	"""
@@ -34,14 +45,50 @@ def save_payload_to_json(payload: Any, filename: str | None = None, prefix: str
 	if filename:
 		out = DATA_DIR / filename
 	else:
-		ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-		out = DATA_DIR / f"{prefix}-{ts}.json"
-	# Zapisujemy z ensure_ascii=False aby poprawnie zapisać polskie znaki
-	with out.open("w", encoding="utf-8") as f:
-		json.dump(payload, f, ensure_ascii=False, indent=2)
+		ts = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+		out = DATA_DIR / f"{prefix}-{ts}.json{'.gz' if compress else ''}"
+	if compress:
+		# surowe odpowiedzi API: bez wcięć i z szybką kompresją - kilkukrotnie mniejsze pliki
+		with gzip.open(out, "wb", compresslevel=1) as f:
+			if orjson is not None:
+				f.write(orjson.dumps(payload))
+			else:
+				f.write(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+		return out
+	# Zapisujemy bez escapowania polskich znaków; json.dump pisałby do pliku drobnymi
+	# kawałkami - serializujemy całość w pamięci i zapisujemy jednym wywołaniem
+	out.write_bytes(_dumps_indented(payload))
 	return out
 
 
+# połączenia do eksportowanych baz (ścieżka -> połączenie) - kolejne eksporty
+# z tej samej bazy nie otwierają jej od nowa i korzystają z rozgrzanego cache stron
+_export_conns: dict[str, sqlite3.Connection] = {}
+
+
+def _export_conn(db_path: str | Path) -> sqlite3.Connection:
+	key = str(db_path)
+	conn = _export_conns.get(key)
+	if conn is None:
+		if not _export_conns:
+			atexit.register(_close_export_conns)
+		conn = _export_conns[key] = sqlite3.connect(key, check_same_thread=False)
+	return conn
+
+
+def _close_export_conns() -> None:
+	for conn in _export_conns.values():
+		conn.close()
+	_export_conns.clear()
+
+
+def _dumps_indented(obj: Any) -> bytes:
+	"""Zserializuj `obj` do JSON z wcięciem 2 (UTF-8); orjson gdy dostępny."""
+	if orjson is not None:
+		return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+	return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
 def export_table_to_json(db_path: str | Path, table: str, out_file: str | None = None) -> Path:
 	"""Wyeksportuj całą tabelę SQLite do pliku JSON (lista rekordów jako dicty).
 
@@ -51,22 +98,32 @@ def export_table_to_json(db_path: str | Path, table: str, out_file: str | None =
 	  - out_file: opcjonalna nazwa pliku wynikowego (jeśli None -> użyj data/<table>-<ts>.json)
 	"""
 	ensure_data_dir()
-	conn = sqlite3.connect(str(db_path))
-	cur = conn.cursor()
-	cur.execute(f"SELECT * FROM {table}")
-	rows = cur.fetchall()
-	cols = [d[0] for d in cur.description]
-	records = [dict(zip(cols, r)) for r in rows]
-	conn.close()
-
 	if out_file:
 		out = DATA_DIR / out_file
 	else:
-		ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+		ts = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
 		out = DATA_DIR / f"{table}-{ts}.json"
 
-	with out.open("w", encoding="utf-8") as f:
-		json.dump(records, f, ensure_ascii=False, indent=2)
+	# rekordy czytamy i zapisujemy partiami - w pamięci jest najwyżej EXPORT_BATCH
+	# wierszy, a nie cała tabela; jeden write na partię
+	cur = _export_conn(db_path).execute(f"SELECT * FROM {table}")
+	try:
+		cols = [d[0] for d in cur.description]
+		with out.open("wb") as f:
+			sep = b"[\n"
+			while True:
+				batch = cur.fetchmany(EXPORT_BATCH)
+				if not batch:
+					break
+				# ten sam układ co json.dump(records, indent=2): rekord wcięty o 2 spacje
+				f.write(sep + b",\n".join(
+					b"  " + _dumps_indented(dict(zip(cols, r))).replace(b"\n", b"\n  ")
+					for r in batch
+				))
+				sep = b",\n"
+			f.write(b"[]" if sep == b"[\n" else b"\n]")
+	finally:
+		cur.close()
 	return out
 
 